@@ -4,50 +4,216 @@ n8n Workflow Generator for Container Tracking Automation
 This script generates an n8n workflow JSON file that:
 1. Monitors emails from sri.sunkara@silkandsnow.com
 2. Downloads and classifies 3 attachments (Bill PDF, CI XLSX, PKL XLSX)
-3. Extracts container numbers from Bill using OpenRouter LLM
-4. Extracts SKU and quantities from PKL using OpenRouter LLM
+3. Extracts container numbers from Bill with an ISO 6346 regex scan
+4. Extracts SKU and quantities from PKL directly, falling back to OpenRouter LLM
 """
 
-import json
+import copy
+import hashlib
 import os
+import sys
 import uuid
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, Any, List
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 
-# Centralized prompt strings
+try:
+    import orjson
+except ImportError:  # optional dependency, fall back to stdlib json
+    orjson = None
+
+def _stdlib_json():
+    """Import the stdlib json fallback on first use; only needed without orjson"""
+    import json
+    return json
+
+def _canonical_bytes(workflow: dict) -> bytes:
+    """Serialize compactly with sorted keys; identical bytes with or without orjson"""
+    if orjson is not None:
+        return orjson.dumps(workflow, option=orjson.OPT_SORT_KEYS)
+    return _stdlib_json().dumps(workflow, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def serialize_workflow(workflow: dict) -> bytes:
+    """Serialize the workflow to the exact bytes written to workflow.json"""
+    if orjson is not None:
+        return orjson.dumps(workflow, option=orjson.OPT_INDENT_2)
+    return _stdlib_json().dumps(workflow, indent=2, ensure_ascii=False).encode("utf-8")
+
+# Centralized prompt strings.
+# Changing any character here must come with a WorkflowConfig.prompt_version
+# bump: the version is part of the LLM response cache key.
 PROMPTS = {
-    "bill_system": (
-        "You are an expert at extracting container numbers from shipping documents. "
-        "Extract all container numbers from the provided text. Container numbers typically "
-        "follow formats like ABCD1234567 or ABCD 123456 7. Return ONLY a JSON object with "
-        "a 'container_numbers' array of strings."
+    # Pure output-shape description; kept byte-stable so it can be cached on its own
+    "extraction_schema": (
+        "Return ONLY a JSON object with this shape:\n"
+        "{\n"
+        "  \"items\": [{\"sku\": \"SNSFNWO5006NR2\", \"qty_expected\": 82}, ...],\n"
+        "  \"doc_total_qty_from_sheet\": 113,\n"
+        "  \"qty_sum\": 113,\n"
+        "  \"checksum_ok\": true\n"
+        "}"
     ),
-    "pkl_system": (
+    "pkl_task": (
         "You read packing lists exported from Excel. "
-        "You are given one sheet as a JSON array of rows. "
-        "Each row is an array of cells in order: [cell_0, cell_1, ...]. Some rows are headers, some are product lines, some are totals.\n\n"
+        "The PKL_ROWS section holds one sheet, one row per line, with cells separated by | in column order "
+        "(empty cells are kept as empty fields). Some rows are headers, some are product lines, some are totals.\n\n"
         "Your tasks:\n\n"
         "1. Identify which column is the SKU column (codes like SNSFNWO5006NR2, usually alphanumeric, stable per product line).\n"
         "2. Identify which column is the line quantity column (count of units for that SKU).\n"
         "   - Prefer columns whose header contains QTY or QUANTITY.\n"
         "   - Do not use weights, CBM, dimensions, or totals as quantity.\n"
-        "3. For each product row with a SKU, output one object with:\n"
+        "3. For each product row with a SKU, output one object in items with:\n"
         "   - sku (string)\n"
         "   - qty_expected (number, quantity for that SKU on that row)\n"
         "4. If the sheet contains a \"Total\" row (cells like Total, TOTAL etc.), extract the document-level total quantity from the appropriate quantity column.\n"
         "5. Compute the sum of all your qty_expected values.\n"
-        "6. Set checksum_ok = true if your sum equals the document-level total quantity (when present), otherwise false.\n\n"
-        "Return ONLY a JSON object with this shape:\n"
-        "{\n"
-        "  \"items\": [{\"sku\": \"SNSFNWO5006NR2\", \"qty_expected\": 82}, ...],\n"
-        "  \"doc_total_qty_from_sheet\": 113,\n"
-        "  \"qty_sum\": 113,\n"
-        "  \"checksum_ok\": true\n"
-        "}"
+        "6. Set checksum_ok = true if your sum equals the document-level total quantity (when present), otherwise false.\n"
+        "   If there is no Total row, set doc_total_qty_from_sheet to null.\n\n"
+        "Reply in the JSON shape given above."
     ),
 }
 
+# Normalize to byte-stable text (no trailing spaces, \n line endings) so a
+# prompt hashes identically across regenerations for provider prompt caches.
+PROMPTS = {
+    key: sys.intern("\n".join(line.rstrip() for line in text.splitlines()))
+    for key, text in PROMPTS.items()
+}
+
+# JSON schema for the PKL chain's Structured Output Parser (mirrors
+# PROMPTS["extraction_schema"]). Every property is required; a missing Total row is null.
+PKL_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sku": {"type": "string"},
+                    "qty_expected": {"type": "number"}
+                },
+                "required": ["sku", "qty_expected"],
+                "additionalProperties": False
+            }
+        },
+        "doc_total_qty_from_sheet": {"type": ["number", "null"]},
+        "qty_sum": {"type": "number"},
+        "checksum_ok": {"type": "boolean"}
+    },
+    "required": ["items", "doc_total_qty_from_sheet", "qty_sum", "checksum_ok"],
+    "additionalProperties": False
+}
+
+# Shared JS helper embedded in the parse nodes' jsCode.
+# The fence regex is a literal hoisted above the per-item loop.
+_EXTRACT_JSON_JS = """const RE_FENCE = /```json([\\s\\S]*?)```/gi;
+
+function extractJson(text) {
+  if (!text) return null;
+
+  // Remove fenced code blocks
+  text = text.replace(RE_FENCE, '$1').trim();
+
+  // If it doesn't start with {, try to slice first {...} block
+  if (!text.startsWith('{')) {
+    const start = text.indexOf('{');
+    const end = text.lastIndexOf('}');
+    if (start !== -1 && end !== -1 && end > start) {
+      text = text.slice(start, end + 1);
+    }
+  }
+
+  try {
+    return JSON.parse(text);
+  } catch (e) {
+    return null;
+  }
+}
+"""
+
+# Shared JS helper finding ISO 6346 container numbers in free text.
+# Owner code + category letter, 6-digit serial, then the check digit:
+# letters map to 10..38 skipping multiples of 11, position i weighs 2^i,
+# and sum mod 11 mod 10 must equal the last digit.
+_CONTAINER_RX_JS = """const RE_CONTAINER = /\\b([A-Z]{4})\\s?(\\d{6})\\s?(\\d)\\b/g;
+const LETTER_VALUES = {};
+for (let c = 0, v = 10; c < 26; c++, v++) {
+  if (v % 11 === 0) v++;
+  LETTER_VALUES[String.fromCharCode(65 + c)] = v;
+}
+
+function validCheckDigit(code) {
+  let sum = 0;
+  for (let i = 0; i < 10; i++) {
+    sum += (i < 4 ? LETTER_VALUES[code[i]] : +code[i]) * (1 << i);
+  }
+  return sum % 11 % 10 === +code[10];
+}
+
+// Canonical (no whitespace) valid container numbers, deduped in order of appearance
+function extractContainers(text, seen = new Set()) {
+  const found = [];
+  for (const m of String(text || '').matchAll(RE_CONTAINER)) {
+    const code = m[1] + m[2] + m[3];
+    if (!seen.has(code) && validCheckDigit(code)) {
+      seen.add(code);
+      found.push(code);
+    }
+  }
+  return found;
+}
+"""
+
+# Ingest Attachments classification rules, in precedence order:
+# (attachment type, whole-word filename keywords, required extension)
+_ATTACHMENT_RULES = (
+    ("bill", ("bill", "bol"), "pdf"),
+    ("commercial_invoice", ("ci",), "xlsx"),
+    ("packaging_list", ("pkl", "pack", "packing"), "xlsx"),
+)
+
+# One anchored JS regex for all rules. Each alternative is a keyword lookahead
+# plus a capture group on the extension, so the first matching rule (not the
+# leftmost keyword) wins and the captured group index names the type.
+_CLASSIFY_RE_JS = "/^(?:" + "|".join(
+    f"(?=.*\\b(?:{'|'.join(words)})\\b)(.*\\.{ext})" for _, words, ext in _ATTACHMENT_RULES
+) + ")$/"
+_CLASSIFY_TYPES_JS = "[" + ", ".join(f"'{t}'" for t, _, _ in _ATTACHMENT_RULES) + "]"
+
+# Slim n8n node representation; optional fields are only emitted when set
+@dataclass(slots=True)
+class Node:
+    id: str
+    name: str
+    type: str
+    typeVersion: float
+    position: List[int]
+    parameters: Dict[str, Any]
+    credentials: Optional[Dict[str, Any]] = None
+    webhookId: Optional[str] = None
+    retryOnFail: Optional[bool] = None
+    maxTries: Optional[int] = None
+    waitBetweenTries: Optional[int] = None
+
+    def to_n8n(self) -> Dict[str, Any]:
+        """Serialize to an n8n node dict, skipping empty optional fields"""
+        d = {
+            "parameters": self.parameters,
+            "id": self.id,
+            "name": self.name,
+            "type": self.type,
+            "typeVersion": self.typeVersion,
+            "position": self.position,
+            "webhookId": self.webhookId,
+            "credentials": self.credentials,
+            "retryOnFail": self.retryOnFail,
+            "maxTries": self.maxTries,
+            "waitBetweenTries": self.waitBetweenTries,
+        }
+        return {k: v for k, v in d.items() if v not in (None, {}, [])}
+
 # Configuration dataclass
 @dataclass
 class WorkflowConfig:
@@ -55,40 +221,47 @@ class WorkflowConfig:
     email_from: str = "sri.sunkara@silkandsnow.com"
     gmail_cred_id: str = "1"
     openrouter_cred_id: str = "1"
-    prompt_version: str = "2025-12-02-01"
+    prompt_version: str = "2026-10-14-05"
+    # Gmail poll schedule (n8n cron with seconds); faster polling costs API quota
+    poll_cron: str = "*/10 * * * * *"
 
-def generate_uuid():
-    """Generate a UUID for n8n nodes"""
-    return str(uuid.uuid4())
+# IDs are name-based UUIDs: the same seed always yields the same ID, so
+# regenerating an unchanged workflow produces identical IDs (and diffs).
+_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "n8n-container-tracking")
 
-def create_openrouter_chat_node(name: str, position: List[int], config: WorkflowConfig) -> Dict[str, Any]:
+def generate_uuid(seed: str) -> str:
+    """Generate a stable ID for an n8n node, condition or assignment"""
+    return str(uuid.uuid5(_ID_NAMESPACE, seed))
+
+def create_openrouter_chat_node(name: str, position: List[int], config: WorkflowConfig) -> Node:
     """Create a shared OpenRouter Chat Model node"""
-    return {
-        "parameters": {
+    return Node(
+        parameters={
             "model": config.openrouter_model,
             "options": {}
         },
-        "id": generate_uuid(),
-        "name": name,
-        "type": "@n8n/n8n-nodes-langchain.lmChatOpenRouter",
-        "typeVersion": 1,
-        "position": position,
-        "credentials": {
+        id=generate_uuid(name),
+        name=name,
+        type="@n8n/n8n-nodes-langchain.lmChatOpenRouter",
+        typeVersion=1,
+        position=position,
+        credentials={
             "openRouterApi": {
                 "id": config.openrouter_cred_id,
                 "name": "OpenRouter account"
             }
         }
-    }
+    )
 
 def create_email_trigger_node(config: WorkflowConfig):
     """Create Gmail trigger node"""
-    return {
-        "parameters": {
+    return Node(
+        parameters={
             "pollTimes": {
                 "item": [
                     {
-                        "mode": "everyMinute"
+                        "mode": "custom",
+                        "cronExpression": config.poll_cron
                     }
                 ]
             },
@@ -100,164 +273,212 @@ def create_email_trigger_node(config: WorkflowConfig):
                 "downloadAttachments": True
             }
         },
-        "id": generate_uuid(),
-        "name": "Gmail Trigger",
-        "type": "n8n-nodes-base.gmailTrigger",
-        "typeVersion": 1,
-        "position": [-768, 112],
-        "webhookId": "gmail-trigger",
-            "credentials": {
-                "gmailOAuth2": {
-                    "id": config.gmail_cred_id,
-                    "name": "Gmail account"
-                }
+        id=generate_uuid("Gmail Trigger"),
+        name="Gmail Trigger",
+        type="n8n-nodes-base.gmailTrigger",
+        typeVersion=1,
+        position=[-768, 112],
+        webhookId="gmail-trigger",
+        credentials={
+            "gmailOAuth2": {
+                "id": config.gmail_cred_id,
+                "name": "Gmail account"
             }
-    }
+        }
+    )
 
 
-def create_split_attachments_node():
-    """Create code node to split Gmail attachments into separate items"""
-    return {
-        "parameters": {
+def create_ingest_attachments_node():
+    """Create code node that splits, classifies and prepares Gmail attachments in one pass"""
+    return Node(
+        parameters={
             "mode": "runOnceForAllItems",
-            "jsCode": """// Split Gmail attachments into separate items
+            "jsCode": """// Ingest Gmail attachments: split, classify and prepare them in one pass
 // Gmail provides attachments as binary fields: attachment_0, attachment_1, attachment_2, etc.
+// Only bills and packaging lists are emitted; commercial invoices and unknown
+// attachments are dropped here so no downstream node ever runs for them.
 const allItems = [];
 
+// One precompiled classifier: capture group n matched => TYPES[n - 1]
+const CLASSIFY = """ + _CLASSIFY_RE_JS + """;
+const TYPES = """ + _CLASSIFY_TYPES_JS + """;
+
+function classify(filenameRaw) {
+  const m = CLASSIFY.exec(filenameRaw.toLowerCase());
+  if (!m) return 'unknown';
+  for (let g = 1; g < m.length; g++) {
+    if (m[g] !== undefined) return TYPES[g - 1];
+  }
+  return 'unknown';
+}
+
+const skip = t => t === 'unknown' || t === 'commercial_invoice';
+
 // Process all input items
 for (const inputItem of $input.all()) {
   const binary = inputItem.binary || {};
   const json = inputItem.json || {};
+
+  // The input item is the Gmail message itself
+  const emailFields = {
+    emailSubject: json.subject || '',
+    emailDate: json.date || '',
+    emailFrom: json.from || json.sender || ''
+  };
   
-  // Find all attachment binary fields
-  const attachmentKeys = Object.keys(binary).filter(key => key.startsWith('attachment_'));
-  
+  // Create one item per known attachment, scanning the binary keys once
+  let foundAttachment = false;
+  for (const key in binary) {
+    if (!key.startsWith('attachment_')) continue;
+    foundAttachment = true;
+    const attachmentNum = key.slice(11);
+    const attachmentData = binary[key];
+    const fileName = attachmentData.fileName;
+    const filename = fileName || attachmentData.filename || `attachment_${attachmentNum}`;
+    const attachmentType = classify(filename);
+    if (skip(attachmentType)) continue;
+
+    allItems.push({
+      json: {
+        ...json,
+        ...emailFields,
+        attachmentKey: key,
+        attachmentIndex: +attachmentNum,
+        attachmentType,
+        filename,
+        mimeType: attachmentData.mimeType || attachmentData.mime || 'application/octet-stream',
+        fileExtension: attachmentData.fileExtension || (fileName ? fileName.slice(fileName.lastIndexOf('.') + 1) : '')
+      },
+      binary: {
+        data: attachmentData
+      }
+    });
+  }
+
   // If no attachment_ keys found, check if binary has 'data' key (from previous processing)
-  if (attachmentKeys.length === 0 && binary.data) {
-    // Already split, pass through
+  if (!foundAttachment && binary.data) {
+    // Already split, classify and pass through
+    const attachmentType = classify(json.filename || json.name || '');
+    if (skip(attachmentType)) continue;
     allItems.push({
-      json: json,
+      json: { ...json, attachmentType },
       binary: binary
     });
-  } else {
-    // Create one item per attachment
-    for (const key of attachmentKeys) {
-      const attachmentNum = key.replace('attachment_', '');
-      const attachmentData = binary[key];
-      
-      allItems.push({
-        json: {
-          ...json,
-          attachmentKey: key,
-          attachmentIndex: parseInt(attachmentNum),
-          filename: attachmentData.fileName || attachmentData.filename || `attachment_${attachmentNum}`,
-          mimeType: attachmentData.mimeType || attachmentData.mime || 'application/octet-stream',
-          fileExtension: attachmentData.fileExtension || (attachmentData.fileName ? attachmentData.fileName.split('.').pop() : '')
-        },
-        binary: {
-          data: attachmentData
-        }
-      });
-    }
   }
 }
 
 return allItems;"""
         },
-        "id": generate_uuid(),
-        "name": "Split Attachments",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [-320, 112]
-    }
-
-def create_classify_attachment_node():
-    """Create code node to classify attachments"""
-    return {
-        "parameters": {
-            "mode": "runOnceForAllItems",
-            "jsCode": """// Classify attachment by filename
-const allItems = [];
-const emailData = $('Gmail Trigger').item.json;
-
-function hasExt(name, ext) {
-  return name.toLowerCase().endsWith(ext.toLowerCase());
-}
+        id=generate_uuid("Ingest Attachments"),
+        name="Ingest Attachments",
+        type="n8n-nodes-base.code",
+        typeVersion=2,
+        position=[-320, 112]
+    )
 
-function containsWord(name, word) {
-  return new RegExp(`\\\\b${word}\\\\b`, 'i').test(name);
-}
+# Switch outputs, in order; each attachment type gets its own branch
+ROUTE_OUTPUTS = ("bill", "packaging_list")
 
-for (const inputItem of $input.all()) {
-  const item = inputItem.json;
-  const binary = inputItem.binary || {};
-  const filenameRaw = item.filename || item.name || '';
-  const filename = filenameRaw.toLowerCase();
-
-  let attachmentType = 'unknown';
-
-  if ((containsWord(filename, 'bill') || containsWord(filename, 'bol')) && hasExt(filename, '.pdf')) {
-    attachmentType = 'bill';
-  } else if (containsWord(filename, 'ci') && hasExt(filename, '.xlsx')) {
-    attachmentType = 'commercial_invoice';
-  } else if (
-    (containsWord(filename, 'pkl') || containsWord(filename, 'pack') || containsWord(filename, 'packing')) &&
-    hasExt(filename, '.xlsx')
-  ) {
-    attachmentType = 'packaging_list';
-  }
+def create_switch_node_route_attachments():
+    """Create Switch node fanning attachments out to one branch per type"""
+    return Node(
+        parameters={
+            "rules": {
+                "values": [
+                    {
+                        "conditions": {
+                            "options": {
+                                "caseSensitive": True,
+                                "leftValue": "",
+                                "typeValidation": "strict",
+                                "version": 1
+                            },
+                            "conditions": [
+                                {
+                                    "id": generate_uuid(f"Route by Type/{attachment_type}"),
+                                    "leftValue": "={{ $json.attachmentType }}",
+                                    "rightValue": attachment_type,
+                                    "operator": {
+                                        "type": "string",
+                                        "operation": "equals"
+                                    }
+                                }
+                            ],
+                            "combinator": "and"
+                        },
+                        "renameOutput": True,
+                        "outputKey": attachment_type
+                    }
+                    for attachment_type in ROUTE_OUTPUTS
+                ]
+            },
+            "options": {}
+        },
+        id=generate_uuid("Route by Type"),
+        name="Route by Type",
+        type="n8n-nodes-base.switch",
+        typeVersion=3,
+        position=[352, 112]
+    )
 
-  allItems.push({
-    json: {
-      ...item,
-      attachmentType,
-      filename: filenameRaw,
-      emailSubject: emailData.subject || '',
-      emailDate: emailData.date || '',
-      emailFrom: emailData.from || emailData.sender || ''
-    },
-    binary,
-  });
-}
+# Cached extraction results older than this are ignored and evicted
+CACHE_TTL_DAYS = 7
 
-return allItems;"""
-        },
-        "id": generate_uuid(),
-        "name": "Classify Attachment",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [-96, 112]
-    }
+def _llm_cache_js(cache_name: str) -> str:
+    """JS snippet binding `cache` to a named result store in workflow static data"""
+    return f"""const TTL_MS = {CACHE_TTL_DAYS} * 24 * 60 * 60 * 1000;
+const staticData = $getWorkflowStaticData('global');
+const cache = staticData.{cache_name} || (staticData.{cache_name} = {{}});
+"""
 
-def create_download_attachment_node():
-    """Create code node to prepare attachment for processing"""
-    return {
-        "parameters": {
+def create_cache_lookup_node(name: str, position: List[int], cache_name: str, config: WorkflowConfig,
+                             output_schema: Dict[str, Any]) -> Node:
+    """Create Code node that looks up a cached extraction result by content hash"""
+    # Results depend on the model and the enforced output shape as much as on the prompt
+    schema_digest = hashlib.sha256(_canonical_bytes(output_schema)).hexdigest()[:16]
+    return Node(
+        parameters={
             "mode": "runOnceForAllItems",
-            "jsCode": """// Prepare attachment data for processing
-// Pass through all items as-is, ensuring binary is properly structured
-const allItems = [];
+            "jsCode": """// Look up a previous extraction result for identical input.
+// Key = sha256(chatInput, prompt version, model, output schema digest), so
+// changing the prompt, the model or the output schema invalidates entries.
+// Needs NODE_FUNCTION_ALLOW_BUILTIN=crypto; static data only persists for active workflows.
+const crypto = require('crypto');
+const KEY_SUFFIX = ['""" + config.prompt_version + """', '""" + config.openrouter_model + """', '""" + schema_digest + """'].join('\\n');
+""" + _llm_cache_js(cache_name) + """
+const now = Date.now();
 
-for (const inputItem of $input.all()) {
-  allItems.push({
-    json: inputItem.json,
-    binary: inputItem.binary || {}
-  });
-}
+return $input.all().map(item => {
+  const cacheKey = crypto.createHash('sha256')
+    .update((item.json.chatInput || '') + '\\n' + KEY_SUFFIX)
+    .digest('hex');
+  const entry = Object.prototype.hasOwnProperty.call(cache, cacheKey) ? cache[cacheKey] : null;
 
-return allItems;"""
+  if (entry && entry.ts > now - TTL_MS) {
+    // A hit already has the parsed result shape, ready for Format Output.
+    // Container numbers come from this email's bill, never from the entry
+    const { ts, container_numbers, ...result } = entry;
+    return { json: { ...result, ...item.json, cacheKey, cached: true } };
+  }
+
+  return {
+    json: { ...item.json, cacheKey, cached: false },
+    binary: item.binary
+  };
+});"""
         },
-        "id": generate_uuid(),
-        "name": "Prepare Attachment",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [128, 112]
-    }
+        id=generate_uuid(name),
+        name=name,
+        type="n8n-nodes-base.code",
+        typeVersion=2,
+        position=position
+    )
 
-def create_if_node_route_attachments():
-    """Create IF node to route attachments to different processing paths"""
-    return {
-        "parameters": {
+def create_flag_if_node(name: str, position: List[int], flag: str, value: Any = True) -> Node:
+    """Create IF node that routes on an item field equal to value (TRUE) or not (FALSE)"""
+    literal = "true" if value is True else f"'{value}'"
+    return Node(
+        parameters={
             "conditions": {
                 "options": {
                     "caseSensitive": True,
@@ -267,12 +488,14 @@ def create_if_node_route_attachments():
                 },
                 "conditions": [
                     {
-                        "id": generate_uuid(),
-                        "leftValue": "={{ $json.attachmentType }}",
-                        "rightValue": "bill",
+                        "id": generate_uuid(f"{name}/{flag}"),
+                        # Compare explicitly so a missing field is false, not a strict type error
+                        "leftValue": f"={{{{ $json.{flag} === {literal} }}}}",
+                        "rightValue": "",
                         "operator": {
-                            "type": "string",
-                            "operation": "equals"
+                            "type": "boolean",
+                            "operation": "true",
+                            "singleValue": True
                         }
                     }
                 ],
@@ -280,191 +503,99 @@ def create_if_node_route_attachments():
             },
             "options": {}
         },
-        "id": generate_uuid(),
-        "name": "Route by Type",
-        "type": "n8n-nodes-base.if",
-        "typeVersion": 2,
-        "position": [352, 112]
-    }
-
-def create_filter_pkl_node():
-    """Create filter node to only process PKL files (not CI)"""
-    return {
-        "parameters": {
-            "conditions": {
-                "options": {
-                    "caseSensitive": False,
-                    "leftValue": "",
-                    "typeValidation": "strict"
-                },
-                "conditions": [
-                    {
-                        "id": generate_uuid(),
-                        "leftValue": "={{ $json.attachmentType }}",
-                        "rightValue": "packaging_list",
-                        "operator": {
-                            "type": "string",
-                            "operation": "equals"
-                        }
-                    }
-                ],
-                "combinator": "and"
-            },
-            "options": {}
-        },
-        "id": generate_uuid(),
-        "name": "Filter PKL Only",
-        "type": "n8n-nodes-base.filter",
-        "typeVersion": 2,
-        "position": [576, 208]
-    }
-
-
-def create_openrouter_model_node(config: WorkflowConfig):
-    """Create OpenRouter Chat Model node"""
-    return create_openrouter_chat_node("OpenRouter Chat Model", [600, 16], config)
-
-def create_openrouter_model_node_pkl(config: WorkflowConfig):
-    """Create OpenRouter Chat Model node for PKL path"""
-    return create_openrouter_chat_node("OpenRouter Chat Model1", [600, 208], config)
-
-def create_pdf_to_text_node():
-    """Create node to convert PDF to text"""
-    return {
-        "parameters": {
-            "operation": "pdf",
-            "options": {
-                "joinPages": True
-            },
-            "binaryPropertyName": "data"
-        },
-        "id": generate_uuid(),
-        "name": "PDF to Text",
-        "type": "n8n-nodes-base.extractFromFile",
-        "typeVersion": 1,
-        "position": [600, 16]
-    }
-
-def create_prepare_bill_data_node():
-    """Create Code node to prepare bill data for LLM extraction"""
-    return {
-        "parameters": {
-            "mode": "runOnceForEachItem",
-            "jsCode": """// Prepare bill data for LLM extraction
-// The PDF text should already be extracted in the 'text' field
-const item = $input.item.json;
-const binary = $input.item.binary || {};
-
-// Get text from extracted PDF
-const textContent = item.text || '';
-
-// Create chatInput field that LLM Chain expects
-return {
-  json: {
-    ...item,
-    chatInput: textContent,
-    text: textContent
-  },
-  binary: binary
-};"""
-        },
-        "id": generate_uuid(),
-        "name": "Prepare Bill Data",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [800, 16]
-    }
-
-def create_openrouter_bill_extraction_node(config: WorkflowConfig):
-    """Create Basic LLM Chain node to extract container numbers from bill"""
-    return {
-        "parameters": {
-            "promptType": "define",
-            "text": "={{ $json.chatInput || $json.text || '' }}",
-            "messages": {
-                "messageValues": [
-                    {
-                        "id": "system",
-                        "message": PROMPTS["bill_system"]
-                    },
-                    {
-                        "id": "user",
-                        "message": "={{ $json.chatInput || $json.text || '' }}"
-                    }
-                ]
-            },
-            "options": {
-                "responseFormat": {
-                    "type": "json_object"
-                }
-            }
-        },
-        "id": generate_uuid(),
-        "name": "Extract Container Numbers",
-        "type": "@n8n/n8n-nodes-langchain.chainLlm",
-        "typeVersion": 1.5,
-        "position": [1000, 16]
-    }
+        id=generate_uuid(name),
+        name=name,
+        type="n8n-nodes-base.if",
+        typeVersion=2,
+        position=position
+    )
 
-def create_parse_openrouter_response_node():
-    """Create Code node to parse LLM response and aggregate all container numbers"""
-    return {
-        "parameters": {
+def create_cache_write_node(name: str, position: List[int], cache_name: str) -> Node:
+    """Create Code node that stores parsed results and evicts expired cache entries"""
+    return Node(
+        parameters={
             "mode": "runOnceForAllItems",
-            "jsCode": """// Parse and aggregate all container numbers from LLM responses
-const allContainers = [];
-
-function extractJson(text) {
-  if (!text) return null;
+            "jsCode": """// Store each freshly parsed result under the cacheKey the parse node carried
+// forward (only set when the LLM reply parsed), then drop entries past their TTL
+// so static data does not grow without bound. The key only covers the PKL rows,
+// so the bill's container numbers are not stored with them.
+""" + _llm_cache_js(cache_name) + """const now = Date.now();
 
-  // Remove fenced code blocks
-  text = text.replace(/```json([\\s\\S]*?)```/gi, '$1').trim();
-
-  // If it doesn't start with {, try to slice first {...} block
-  if (!text.trim().startsWith('{')) {
-    const start = text.indexOf('{');
-    const end = text.lastIndexOf('}');
-    if (start !== -1 && end !== -1 && end > start) {
-      text = text.slice(start, end + 1);
-    }
+const items = $input.all();
+for (const item of items) {
+  const { cacheKey, container_numbers, ...result } = item.json;
+  if (cacheKey) {
+    cache[cacheKey] = { ...result, ts: now };
   }
+}
 
-  try {
-    return JSON.parse(text);
-  } catch (e) {
-    return null;
+for (const [key, entry] of Object.entries(cache)) {
+  if (!entry || !(entry.ts > now - TTL_MS)) {
+    delete cache[key];
   }
 }
 
-for (const item of $input.all()) {
-  const text = item.json.text || item.json.response || '';
-  const parsed = extractJson(text);
-  if (!parsed) continue;
+return items;"""
+        },
+        id=generate_uuid(name),
+        name=name,
+        type="n8n-nodes-base.code",
+        typeVersion=2,
+        position=position
+    )
+
+def create_extraction_cache_lookup_node(config: WorkflowConfig):
+    """Create cache lookup node for the PKL extraction chain"""
+    return create_cache_lookup_node("Extraction Cache Lookup", [1672, 112], "extractionResultCache", config, PKL_OUTPUT_SCHEMA)
 
-  if (parsed.container_numbers && Array.isArray(parsed.container_numbers)) {
-    allContainers.push(...parsed.container_numbers);
+def create_extraction_cache_write_node():
+    """Create cache write node storing parsed extraction results"""
+    return create_cache_write_node("Extraction Cache Write", [2568, 112], "extractionResultCache")
+
+def create_openrouter_model_node(config: WorkflowConfig):
+    """Create OpenRouter Chat Model node"""
+    return create_openrouter_chat_node("OpenRouter Chat Model", [2120, 320], config)
+
+def create_extract_containers_fused_node():
+    """Create Code node that reads the bill PDF text and finds container numbers in one pass"""
+    return Node(
+        parameters={
+            "mode": "runOnceForAllItems",
+            "jsCode": """// Fused bill step: PDF text extraction and the container scan run in one node,
+// so the full bill text is never copied into item JSON.
+// Container numbers are fully regular (ISO 6346), so a regex scan with the
+// check digit replaces an LLM call and never hallucinates an ID.
+// Needs NODE_FUNCTION_ALLOW_EXTERNAL=pdfjs-dist (the PDF library bundled with n8n).
+const pdfjs = require('pdfjs-dist/legacy/build/pdf.js');
+""" + _CONTAINER_RX_JS + """
+const seen = new Set();
+const containerNumbers = [];
+const items = $input.all();
+for (let i = 0; i < items.length; i++) {
+  // Works in both memory and filesystem binary data modes
+  const buffer = await this.helpers.getBinaryDataBuffer(i, 'data');
+  const doc = await pdfjs.getDocument({ data: new Uint8Array(buffer) }).promise;
+  for (let p = 1; p <= doc.numPages; p++) {
+    const page = await doc.getPage(p);
+    const content = await page.getTextContent();
+    containerNumbers.push(...extractContainers(content.items.map(x => x.str).join(' '), seen));
   }
+  await doc.destroy();
 }
 
-// Remove duplicates and return single item with aggregated containers
-return [{
-  json: {
-    container_numbers: [...new Set(allContainers)]
-  }
-}];"""
+return [{ json: { container_numbers: containerNumbers } }];"""
         },
-        "id": generate_uuid(),
-        "name": "Parse Container Response",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [1224, 16]
-    }
-
+        id=generate_uuid("Extract Containers (PDF)"),
+        name="Extract Containers (PDF)",
+        type="n8n-nodes-base.code",
+        typeVersion=2,
+        position=[600, 16]
+    )
 
 def create_xlsx_read_node():
     """Create node to read XLSX file - using Extract From File node which can handle XLSX"""
-    return {
-        "parameters": {
+    return Node(
+        parameters={
             "operation": "xlsx",
             "options": {
                 "sheetName": "",
@@ -473,106 +604,260 @@ def create_xlsx_read_node():
             },
             "binaryPropertyName": "data"
         },
-        "id": generate_uuid(),
-        "name": "Read XLSX",
-        "type": "n8n-nodes-base.extractFromFile",
-        "typeVersion": 1,
-        "position": [600, 208]
-    }
+        id=generate_uuid("Read XLSX"),
+        name="Read XLSX",
+        type="n8n-nodes-base.extractFromFile",
+        typeVersion=1,
+        position=[600, 208]
+    )
 
-def create_normalize_pkl_grid_node():
-    """Create Code node to prepare PKL data - send raw rows as JSON to LLM"""
-    return {
-        "parameters": {
+def create_extract_pkl_direct_node():
+    """Create Code node that extracts SKU quantities from the PKL grid without an LLM when it can"""
+    return Node(
+        parameters={
             "mode": "runOnceForAllItems",
-            "jsCode": """// Generic PKL pre-processor.
+            "jsCode": """// Deterministic PKL extractor with an LLM fallback.
 // ExtractFromFile gives one item per row as json.row (your sample).
-// We do NOT assume any fixed columns; we just send all rows as JSON.
+// When a header row names the SKU and quantity columns, the items are read
+// straight from the grid and must match their Total row. pkl_status says what
+// happened: "extracted" (items ready), "fallback" (the LLM gets chatInput) or
+// "absent" (the sheet had no rows).
 
-const rows = $input.all()
-  .map(i => i.json.row || [])
-  .filter(r => Array.isArray(r) && r.length > 0);
+// Single pass: skip empty rows and drop trailing empty cells to keep the prompt small.
+// Cell objects like {t:'n', v:82, w:'82'} are reduced to their raw value v, and
+// rows are marshaled as pipe-delimited lines, far fewer tokens than JSON.
+function cell(c) {
+  const v = (c && typeof c === 'object' && 'v' in c) ? c.v : c;
+  return v == null ? '' : String(v).replace(/[|\\r\\n]+/g, ' ');
+}
+
+// One input item per sheet row: size the output once, fill by index, then
+// truncate to the non-empty rows instead of growing it push by push.
+const inputs = $input.all();
+const grid = new Array(inputs.length);
+let n = 0;
+for (let k = 0; k < inputs.length; k++) {
+  const raw = inputs[k].json.row;
+  if (!Array.isArray(raw) || raw.length === 0) continue;
+  const r = raw.map(cell);
+  let end = r.length;
+  while (end > 0 && r[end - 1] === '') end--;
+  if (end) grid[n++] = end === r.length ? r : r.slice(0, end);
+}
+grid.length = n;
+
+const RE_SKU_HEADER = /\\b(?:sku|item\\s*code)\\b/i;
+// Most specific first, so "Total Qty" wins over a per-carton "Qty/Ctn"
+const QTY_HEADERS = [
+  /\\btotal\\s*(?:qty|quantity)\\b/i,
+  /\\b(?:qty|quantity)\\s*expected\\b/i,
+  /\\bexpected\\b/i,
+  /\\bquantity\\b/i,
+  /\\bqty\\b/i
+];
+const RE_TOTAL = /^total\\b/i;
+const SKU_RE = /^[A-Z]{2,}[0-9A-Z]{4,}$/;
+// Blank cells are missing values, not zero
+const num = s => {
+  const t = String(s).replace(/,/g, '').trim();
+  return t === '' ? NaN : Number(t);
+};
+
+// Quantity column of a header row: -1 if none, -2 if the best match is ambiguous
+function qtyColumn(row) {
+  for (const re of QTY_HEADERS) {
+    const cols = [];
+    row.forEach((c, i) => { if (re.test(c)) cols.push(i); });
+    if (cols.length === 1) return cols[0];
+    if (cols.length > 1) return -2;
+  }
+  return -1;
+}
 
-// chatInput is a JSON string with the array-of-rows.
+// Read XLSX hands over every packing-list row of the execution, so the grid
+// may hold several header ... Total sections (two attachments, or two emails
+// in one poll). Each section is read with its own columns and must match its
+// own Total row; a product row outside any section sends the grid to the LLM.
+const items = [];
+let docTotal = 0;
+let sections = 0;
+let parsedOk = true;
+let lastSkuCol = -1;
+let k = 0;
+while (parsedOk && k < grid.length) {
+  let skuCol = -1;
+  let qtyCol = -1;
+  while (k < grid.length) {
+    const row = grid[k++];
+    skuCol = row.findIndex(c => RE_SKU_HEADER.test(c));
+    qtyCol = skuCol < 0 ? -1 : qtyColumn(row);
+    if (qtyCol !== -1) break;
+    if (lastSkuCol >= 0 && SKU_RE.test((row[lastSkuCol] || '').trim())) {
+      parsedOk = false;
+      break;
+    }
+  }
+  if (!parsedOk || qtyCol === -1) break;
+  if (qtyCol < 0) {
+    parsedOk = false;
+    break;
+  }
+
+  let sum = 0;
+  let total = NaN;
+  for (; k < grid.length; k++) {
+    const r = grid[k];
+    if (r.some(c => RE_TOTAL.test(c.trim()))) {
+      total = num(r[qtyCol] || '');
+      k++;
+      break;
+    }
+    const sku = (r[skuCol] || '').trim();
+    if (!SKU_RE.test(sku)) continue;
+    const qty = num(r[qtyCol] || '');
+    if (!Number.isFinite(qty)) {
+      parsedOk = false;
+      break;
+    }
+    items.push({ sku, qty_expected: qty });
+    sum += qty;
+  }
+  // Without a matching Total row nothing vouches for the chosen columns
+  if (!(Number.isFinite(total) && sum === total)) parsedOk = false;
+  docTotal += total;
+  sections++;
+  lastSkuCol = skuCol;
+}
+
+const qtySum = items.reduce((acc, it) => acc + it.qty_expected, 0);
+const pklExtracted = parsedOk && sections > 0 && items.length > 0;
+const pklStatus = grid.length === 0 ? 'absent' : pklExtracted ? 'extracted' : 'fallback';
+
+// Merge Results pairs this with the container numbers; the LLM chain reads chatInput
 return [{
   json: {
-    rows,
-    chatInput: JSON.stringify(rows)
+    pkl_status: pklStatus,
+    ...(pklStatus === 'absent' ? {} : pklExtracted ? {
+      pkl_items: items,
+      qty_sum: qtySum,
+      doc_total_qty: docTotal,
+      checksum_ok: true
+    } : {
+      chatInput: 'PKL_ROWS:\\n' + grid.map(r => r.join('|')).join('\\n')
+    })
   }
 }];"""
         },
-        "id": generate_uuid(),
-        "name": "Normalize PKL Grid",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [800, 208]
-    }
+        id=generate_uuid("Extract PKL (Direct)"),
+        name="Extract PKL (Direct)",
+        type="n8n-nodes-base.code",
+        typeVersion=2,
+        position=[1000, 208]
+    )
+
+def create_merge_node():
+    """Create Merge node that pairs each email's container numbers with its PKL rows"""
+    return Node(
+        parameters={
+            "mode": "combine",
+            "combineBy": "combineByPosition",
+            "options": {
+                # Still extract when only one of the two attachments arrived
+                "includeUnpaired": True
+            }
+        },
+        id=generate_uuid("Merge Results"),
+        name="Merge Results",
+        type="n8n-nodes-base.merge",
+        typeVersion=3,
+        position=[1224, 112]
+    )
 
 def create_openrouter_pkl_extraction_node(config: WorkflowConfig):
-    """Create Basic LLM Chain node to extract SKU and quantities from PKL"""
-    return {
-        "parameters": {
+    """Create Basic LLM Chain node extracting SKU quantities from the PKL rows"""
+    return Node(
+        parameters={
             "promptType": "define",
+            # The labeled PKL rows are sent once, as the final user turn
             "text": "={{ $json.chatInput }}",
             "messages": {
                 "messageValues": [
+                    # Static system messages only; the invariant schema goes first
+                    # so message-boundary prefix caches survive task wording changes
                     {
-                        "id": "system",
-                        "message": PROMPTS["pkl_system"]
+                        "id": "system_schema",
+                        "message": PROMPTS["extraction_schema"]
                     },
                     {
-                        "id": "user",
-                        "message": "=Here is the sheet as JSON array-of-rows:\n\n{{ $json.chatInput }}"
+                        "id": "system_pkl",
+                        "message": PROMPTS["pkl_task"]
                     }
                 ]
             },
-            "options": {
-                "responseFormat": {
-                    "type": "json_object"
-                }
-            }
+            # The reply shape is enforced by the attached Structured Output Parser
+            "hasOutputParser": True
         },
-        "id": generate_uuid(),
-        "name": "Extract SKU & Quantities",
-        "type": "@n8n/n8n-nodes-langchain.chainLlm",
-        "typeVersion": 1.5,
-        "position": [1000, 208]
-    }
+        id=generate_uuid("Extract SKU & Quantities"),
+        name="Extract SKU & Quantities",
+        type="@n8n/n8n-nodes-langchain.chainLlm",
+        typeVersion=1.5,
+        position=[2120, 112],
+        # Ride out OpenRouter rate limits and transient errors
+        retryOnFail=True,
+        maxTries=5,
+        waitBetweenTries=2000
+    )
+
+def create_pkl_output_parser_node():
+    """Create Structured Output Parser node validating the PKL reply against PKL_OUTPUT_SCHEMA"""
+    return Node(
+        parameters={
+            "schemaType": "manual",
+            "inputSchema": serialize_workflow(PKL_OUTPUT_SCHEMA).decode("utf-8")
+        },
+        id=generate_uuid("PKL Output Parser"),
+        name="PKL Output Parser",
+        type="@n8n/n8n-nodes-langchain.outputParserStructured",
+        typeVersion=1.2,
+        position=[2344, 320]
+    )
 
-def create_parse_pkl_response_node():
-    """Create Code node to parse PKL extraction response, aggregate items, and verify checksum"""
-    return {
-        "parameters": {
+def create_parse_extraction_response_node():
+    """Create Code node to parse the PKL response, attach the container numbers and verify the checksum"""
+    return Node(
+        parameters={
             "mode": "runOnceForAllItems",
-            "jsCode": """// Parse PKL LLM JSON and enforce our own checksum.
+            "jsCode": """// Parse the PKL LLM JSON, re-attach the regex container numbers and enforce our own checksum.
 
+const allContainers = [];
 const allItems = [];
 let docTotalFromSheet = null;
 let llmReportedSum = null;
 let llmChecksumOk = null;
+let cacheKey = null;
+let parsedOk = false;
 
-function extractJson(text) {
-  if (!text) return null;
-  text = text.replace(/```json[\\s\\S]*?```/gi, m => m.replace(/```json|```/gi, '')).trim();
-  if (!text.trim().startsWith('{')) {
-    const start = text.indexOf('{');
-    const end = text.lastIndexOf('}');
-    if (start !== -1 && end !== -1 && end > start) {
-      text = text.slice(start, end + 1);
-    }
+""" + _EXTRACT_JSON_JS + """
+// The LLM chain only returns text; container numbers and the cache key stay on
+// the lookup item. Resolve the node proxy once, not per item.
+const lookup = $('Extraction Cache Lookup');
+for (const [i, item] of $input.all().entries()) {
+  const upstream = lookup.itemMatching(i).json;
+  if (Array.isArray(upstream.container_numbers)) {
+    allContainers.push(...upstream.container_numbers);
   }
-  try {
-    return JSON.parse(text);
-  } catch (e) {
-    return null;
-  }
-}
 
-for (const item of $input.all()) {
-  const text = item.json.text || item.json.response || '';
-  const parsed = extractJson(text);
+  // The output parser hands over an object; plain text is parsed as a fallback
+  const output = item.json.output;
+  const parsed = output && typeof output === 'object'
+    ? output
+    : extractJson(item.json.text || item.json.response || '');
   if (!parsed) continue;
 
+  // Only a response that actually parsed may be cached
+  parsedOk = true;
+  cacheKey = upstream.cacheKey || cacheKey;
+
   if (Array.isArray(parsed.items)) {
     allItems.push(...parsed.items);
   }
@@ -587,6 +872,19 @@ for (const item of $input.all()) {
   }
 }
 
+// Canonicalize (no whitespace, upper case) so "ABCD 123456 7" and "ABCD1234567"
+// collapse, keep only ISO 6346 shaped codes, and dedupe in one pass
+const RE_CONTAINER = /^[A-Z]{4}\\d{7}$/;
+const seen = new Set();
+const containerNumbers = [];
+for (const c of allContainers) {
+  const norm = String(c).replace(/\\s+/g, '').toUpperCase();
+  if (RE_CONTAINER.test(norm) && !seen.has(norm)) {
+    seen.add(norm);
+    containerNumbers.push(norm);
+  }
+}
+
 // Recompute sum ourselves
 const recomputedSum = allItems.reduce(
   (acc, it) => acc + (Number(it.qty_expected) || 0),
@@ -598,8 +896,13 @@ if (Number.isFinite(docTotalFromSheet)) {
   checksumOk = recomputedSum === docTotalFromSheet;
 }
 
+// Without a parsed response there is no cacheKey, so Cache Write skips the
+// item and a re-delivery of the same packing list retries the LLM
 return [{
   json: {
+    ...(parsedOk ? { cacheKey } : {}),
+    parsed_ok: parsedOk,
+    container_numbers: containerNumbers,
     pkl_items: allItems,
     qty_sum: recomputedSum,
     doc_total_qty: docTotalFromSheet,
@@ -609,196 +912,252 @@ return [{
   }
 }];"""
         },
-        "id": generate_uuid(),
-        "name": "Parse PKL Response",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [1224, 208]
-    }
-
-def create_merge_node():
-    """Create Code node to combine data from both parse nodes, handling timing delays"""
-    return {
-        "parameters": {
-            "mode": "runOnceForAllItems",
-            "jsCode": "// Combine container numbers and PKL items from both parse nodes\n// This handles timing delays by waiting for all inputs\nlet containerNumbers = [];\nlet pklItems = [];\n\n// Process all input items - they may come from either parse node\nfor (const item of $input.all()) {\n  const json = item.json || {};\n  \n  // Check if this item has container_numbers (from Parse Container Response)\n  if (json.container_numbers && Array.isArray(json.container_numbers)) {\n    containerNumbers = json.container_numbers;\n  }\n  \n  // Check if this item has pkl_items (from Parse PKL Response)\n  if (json.pkl_items && Array.isArray(json.pkl_items)) {\n    pklItems = json.pkl_items;\n  }\n}\n\n// Return combined result\nreturn [{\n  json: {\n    container_numbers: containerNumbers,\n    pkl_items: pklItems\n  }\n}];"
-        },
-        "id": generate_uuid(),
-        "name": "Merge Results",
-        "type": "n8n-nodes-base.code",
-        "typeVersion": 2,
-        "position": [1448, 112]
-    }
+        id=generate_uuid("Parse Extraction Response"),
+        name="Parse Extraction Response",
+        type="n8n-nodes-base.code",
+        typeVersion=2,
+        position=[2344, 112]
+    )
 
 def create_final_output_node():
     """Create node to format final output with only containers, SKUs, and quantities"""
-    return {
-        "parameters": {
+    return Node(
+        parameters={
             "assignments": {
                 "assignments": [
                     {
-                        "id": generate_uuid(),
+                        "id": generate_uuid("Format Output/container_numbers"),
                         "name": "container_numbers",
                         "value": "={{ $json.container_numbers || [] }}",
                         "type": "array"
                     },
                     {
-                        "id": generate_uuid(),
+                        "id": generate_uuid("Format Output/sku_items"),
                         "name": "sku_items",
                         "value": "={{ $json.pkl_items || [] }}",
                         "type": "array"
+                    },
+                    {
+                        "id": generate_uuid("Format Output/processed_at"),
+                        "name": "processed_at",
+                        # n8n expression, evaluated per execution rather than at generate time
+                        "value": "={{ $now.toISO() }}",
+                        "type": "string"
                     }
                 ]
             },
             "options": {}
         },
-        "id": generate_uuid(),
-        "name": "Format Output",
-        "type": "n8n-nodes-base.set",
-        "typeVersion": 3.4,
-        "position": [1672, 112]
-    }
+        id=generate_uuid("Format Output"),
+        name="Format Output",
+        type="n8n-nodes-base.set",
+        typeVersion=3.4,
+        position=[2792, 112]
+    )
 
 def validate_workflow(workflow: dict) -> None:
     """Validate workflow structure - check that all connections reference valid nodes"""
-    node_names = {n["name"] for n in workflow["nodes"]}
+    node_names = frozenset(n["name"] for n in workflow["nodes"])
+    errors = []
     for from_node, conn in workflow["connections"].items():
-        assert from_node in node_names, f"Unknown from-node: {from_node}"
-        for outputs in conn.get("main", []):
-            for dest in outputs:
-                assert dest["node"] in node_names, f"Unknown to-node: {dest['node']}"
+        if from_node not in node_names:
+            errors.append(f"Unknown from-node: {from_node}")
+        # Every connection type: main, ai_languageModel, ai_outputParser
+        for outputs_list in conn.values():
+            for outputs in outputs_list:
+                for dest in outputs:
+                    if dest["node"] not in node_names:
+                        errors.append(f"Unknown to-node: {dest['node']}")
+    if errors:
+        raise ValueError("Invalid workflow connections: " + "; ".join(errors))
 
-def create_workflow(config: WorkflowConfig):
-    """Generate the complete n8n workflow"""
+def build_connections(edges: List[Tuple[Node, Node, str, int, int]]) -> Dict[str, Any]:
+    """Build the n8n connections object from (source, destination, type, output, input) edges"""
+    connections: Dict[str, Any] = {}
+    for src, dst, conn_type, output, input_index in edges:
+        outputs = connections.setdefault(src.name, {}).setdefault(conn_type, [])
+        # Pad so unconnected lower outputs still hold their slot
+        while len(outputs) <= output:
+            outputs.append([])
+        outputs[output].append({"node": dst.name, "type": conn_type, "index": input_index})
+    return connections
+
+def _assemble_workflow(config: WorkflowConfig):
+    """Assemble the n8n workflow structure (nodes + connections) for a config"""
     
     # Create all nodes
     email_trigger = create_email_trigger_node(config)
-    split_attachments = create_split_attachments_node()
-    classify_attachment = create_classify_attachment_node()
-    download_attachment = create_download_attachment_node()
-    route_by_type = create_if_node_route_attachments()
+    ingest_attachments = create_ingest_attachments_node()
+    route_by_type = create_switch_node_route_attachments()
     
-    # Create OpenRouter model nodes (one for each extraction chain)
+    # OpenRouter model for the PKL extraction chain
     openrouter_model = create_openrouter_model_node(config)
-    openrouter_model_pkl = create_openrouter_model_node_pkl(config)
     
-    # Bill processing path - PDF extraction then prepare data
-    pdf_to_text = create_pdf_to_text_node()
-    prepare_bill_data = create_prepare_bill_data_node()
-    extract_containers = create_openrouter_bill_extraction_node(config)
-    parse_containers = create_parse_openrouter_response_node()
+    # Bill path - PDF text and regex container scan, fused in one node
+    extract_containers = create_extract_containers_fused_node()
     
-    # PKL processing path - XLSX reading then normalize grid
-    filter_pkl = create_filter_pkl_node()
+    # PKL path - XLSX reading then deterministic extraction
     read_xlsx = create_xlsx_read_node()
-    normalize_pkl_grid = create_normalize_pkl_grid_node()
-    extract_pkl = create_openrouter_pkl_extraction_node(config)
-    parse_pkl = create_parse_pkl_response_node()
+    extract_pkl_direct = create_extract_pkl_direct_node()
     
-    # Merge and output
+    # Both documents meet here; the LLM only runs if direct PKL extraction failed.
+    # Bill-only emails reach the IF with no pkl_status and go straight to output.
     merge_results = create_merge_node()
+    needs_llm = create_flag_if_node("Needs LLM Fallback?", [1448, 112], "pkl_status", "fallback")
+    extraction_cache_lookup = create_extraction_cache_lookup_node(config)
+    extraction_cache_hit = create_flag_if_node("Extraction Cache Hit?", [1896, 112], "cached")
+    extract_pkl = create_openrouter_pkl_extraction_node(config)
+    pkl_output_parser = create_pkl_output_parser_node()
+    parse_extraction = create_parse_extraction_response_node()
+    extraction_cache_write = create_extraction_cache_write_node()
     format_output = create_final_output_node()
     
-    # Build top-level connections object (n8n format)
-    connections = {
-        email_trigger["name"]: {
-            "main": [[{"node": split_attachments["name"], "type": "main", "index": 0}]]
-        },
-        split_attachments["name"]: {
-            "main": [[{"node": classify_attachment["name"], "type": "main", "index": 0}]]
-        },
-        classify_attachment["name"]: {
-            "main": [[{"node": download_attachment["name"], "type": "main", "index": 0}]]
-        },
-        download_attachment["name"]: {
-            "main": [[{"node": route_by_type["name"], "type": "main", "index": 0}]]
-        },
-        route_by_type["name"]: {
-            "main": [
-                [{"node": pdf_to_text["name"], "type": "main", "index": 0}],  # True: bill path
-                [{"node": filter_pkl["name"], "type": "main", "index": 0}]     # False: PKL/CI path
-            ]
-        },
-        openrouter_model["name"]: {
-            "ai_languageModel": [
-                [{"node": extract_containers["name"], "type": "ai_languageModel", "index": 0}]
-            ]
-        },
-        openrouter_model_pkl["name"]: {
-            "ai_languageModel": [
-                [{"node": extract_pkl["name"], "type": "ai_languageModel", "index": 0}]
-            ]
-        },
-        pdf_to_text["name"]: {
-            "main": [[{"node": prepare_bill_data["name"], "type": "main", "index": 0}]]
-        },
-        prepare_bill_data["name"]: {
-            "main": [[{"node": extract_containers["name"], "type": "main", "index": 0}]]
-        },
-        extract_containers["name"]: {
-            "main": [[{"node": parse_containers["name"], "type": "main", "index": 0}]]
-        },
-        parse_containers["name"]: {
-            "main": [[{"node": merge_results["name"], "type": "main", "index": 0}]]
-        },
-        filter_pkl["name"]: {
-            "main": [[{"node": read_xlsx["name"], "type": "main", "index": 0}]]
-        },
-        read_xlsx["name"]: {
-            "main": [[{"node": normalize_pkl_grid["name"], "type": "main", "index": 0}]]
-        },
-        normalize_pkl_grid["name"]: {
-            "main": [[{"node": extract_pkl["name"], "type": "main", "index": 0}]]
-        },
-        extract_pkl["name"]: {
-            "main": [[{"node": parse_pkl["name"], "type": "main", "index": 0}]]
-        },
-        parse_pkl["name"]: {
-            "main": [[{"node": merge_results["name"], "type": "main", "index": 0}]]
-        },
-        merge_results["name"]: {
-            "main": [[{"node": format_output["name"], "type": "main", "index": 0}]]
-        }
-    }
+    # Graph edges: (source, destination, connection type, source output, destination input)
+    edges = [
+        (email_trigger, ingest_attachments, "main", 0, 0),
+        (ingest_attachments, route_by_type, "main", 0, 0),
+        (route_by_type, extract_containers, "main", 0, 0),         # bill
+        (route_by_type, read_xlsx, "main", 1, 0),                  # packaging_list
+        (openrouter_model, extract_pkl, "ai_languageModel", 0, 0),
+        (pkl_output_parser, extract_pkl, "ai_outputParser", 0, 0),
+        (extract_containers, merge_results, "main", 0, 0),
+        (read_xlsx, extract_pkl_direct, "main", 0, 0),
+        (extract_pkl_direct, merge_results, "main", 0, 1),
+        (merge_results, needs_llm, "main", 0, 0),
+        (needs_llm, extraction_cache_lookup, "main", 0, 0),        # True: LLM fallback
+        (needs_llm, format_output, "main", 1, 0),                  # False: extracted, or no PKL
+        (extraction_cache_lookup, extraction_cache_hit, "main", 0, 0),
+        (extraction_cache_hit, format_output, "main", 0, 0),       # True: cached result
+        (extraction_cache_hit, extract_pkl, "main", 1, 0),         # False: call LLM
+        (extract_pkl, parse_extraction, "main", 0, 0),
+        (parse_extraction, extraction_cache_write, "main", 0, 0),
+        (extraction_cache_write, format_output, "main", 0, 0),
+    ]
+    
+    nodes = [
+        email_trigger,
+        ingest_attachments,
+        route_by_type,
+        openrouter_model,
+        extract_containers,
+        read_xlsx,
+        extract_pkl_direct,
+        merge_results,
+        needs_llm,
+        extraction_cache_lookup,
+        extraction_cache_hit,
+        extract_pkl,
+        pkl_output_parser,
+        parse_extraction,
+        extraction_cache_write,
+        format_output
+    ]
     
     # Build workflow
     workflow = {
         "name": "Container Tracking Automation",
-        "nodes": [
-            email_trigger,
-            split_attachments,
-            classify_attachment,
-            download_attachment,
-            route_by_type,
-            openrouter_model,
-            openrouter_model_pkl,
-            pdf_to_text,
-            prepare_bill_data,
-            extract_containers,
-            parse_containers,
-            filter_pkl,
-            read_xlsx,
-            normalize_pkl_grid,
-            extract_pkl,
-            parse_pkl,
-            merge_results,
-            format_output
-        ],
-        "connections": connections,
+        "nodes": [node.to_n8n() for node in nodes],
+        "connections": build_connections(edges),
         "pinData": {},
         "settings": {
             "executionOrder": "v1",
+            # Keep execution-log DB writes to failures only: no per-node
+            # progress saves, and no attachment-heavy data for successful runs
+            "saveManualExecutions": False,
+            "saveExecutionProgress": False,
+            "saveDataSuccessExecution": "none",
+            "saveDataErrorExecution": "all",
+            "callerPolicy": "workflowsFromSameOwner",
+            "executionTimeout": 300,
+            "timezone": "UTC",
             "promptVersion": config.prompt_version
         },
         "staticData": None,
+        # instanceId is left out: n8n fills it in for the importing instance
+        "meta": {
+            "templateCredsSetupCompleted": True
+        },
         "tags": [],
         "triggerCount": 1,
-        "updatedAt": datetime.now().isoformat(),
-        "versionId": generate_uuid()
+        "updatedAt": None,
+        "versionId": None
     }
     
     return workflow
 
+# Placeholder config used to build the workflow skeleton once at import time.
+# Every per-call value is a sentinel string that create_workflow() substitutes.
+_TEMPLATE_CONFIG = WorkflowConfig(
+    openrouter_model="__MODEL__",
+    email_from="__EMAIL_FROM__",
+    gmail_cred_id="__GMAIL_CRED__",
+    openrouter_cred_id="__OR_CRED__",
+    prompt_version="__PROMPT_VER__",
+    poll_cron="__POLL_CRON__",
+)
+_SENTINELS = {getattr(_TEMPLATE_CONFIG, f.name): f.name for f in fields(WorkflowConfig)}
+
+def _index_slots(obj, path: Tuple, config_slots: List) -> None:
+    """Record the paths of every config sentinel in the template"""
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj)
+    for key, value in items:
+        if isinstance(value, (dict, list)):
+            _index_slots(value, path + (key,), config_slots)
+        elif isinstance(value, str):
+            sentinels = tuple(s for s in _SENTINELS if s in value)
+            if sentinels:
+                config_slots.append((path + (key,), value, sentinels))
+
+def _build_template():
+    """Build the workflow skeleton once and index its per-call slots"""
+    template = _assemble_workflow(_TEMPLATE_CONFIG)
+    config_slots = []
+    _index_slots(template, (), config_slots)
+    return template, config_slots
+
+def _set_path(root, path: Tuple, value) -> None:
+    """Assign value at a precomputed key path inside the workflow tree"""
+    for key in path[:-1]:
+        root = root[key]
+    root[path[-1]] = value
+
+_TEMPLATE, _CONFIG_SLOTS = _build_template()
+
+def _build_timestamp() -> str:
+    """Return the build time, honouring SOURCE_DATE_EPOCH for reproducible output"""
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        return datetime.fromtimestamp(int(epoch), tz=timezone.utc).isoformat()
+    return datetime.now(timezone.utc).isoformat()
+
+def create_workflow(config: WorkflowConfig):
+    """Generate the complete n8n workflow from the cached skeleton"""
+    workflow = copy.deepcopy(_TEMPLATE)
+    
+    # IDs are already final in the template; only config values vary per call
+    for path, value, sentinels in _CONFIG_SLOTS:
+        for sentinel in sentinels:
+            value = value.replace(sentinel, getattr(config, _SENTINELS[sentinel]))
+        _set_path(workflow, path, value)
+    
+    # versionId is a content hash (taken while versionId/updatedAt are still
+    # None), so it only changes when the workflow itself changes
+    workflow["versionId"] = hashlib.sha256(_canonical_bytes(workflow)).hexdigest()[:32]
+    workflow["updatedAt"] = _build_timestamp()
+    
+    return workflow
+
+def _reuse_updated_at(workflow: dict, old_bytes: Optional[bytes]) -> None:
+    """Keep the previous updatedAt when the content hash (versionId) is unchanged"""
+    if not old_bytes or os.environ.get("SOURCE_DATE_EPOCH"):
+        return
+    try:
+        previous = orjson.loads(old_bytes) if orjson is not None else _stdlib_json().loads(old_bytes)
+    except ValueError:  # unreadable old file: just overwrite it
+        return
+    if previous.get("versionId") == workflow["versionId"] and previous.get("updatedAt"):
+        workflow["updatedAt"] = previous["updatedAt"]
+
 def main():
     """Main function to generate and save workflow"""
     print("Generating n8n workflow for Container Tracking Automation...")
@@ -813,12 +1172,24 @@ def main():
     # Validate workflow structure
     validate_workflow(workflow)
     
-    output_file = "workflow.json"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(workflow, f, indent=2, ensure_ascii=False)
+    output_file = Path("workflow.json")
+    try:
+        old_bytes = output_file.read_bytes()
+    except FileNotFoundError:
+        old_bytes = None
+    
+    # An unchanged workflow keeps its timestamp, so its bytes are identical too
+    _reuse_updated_at(workflow, old_bytes)
+    new_bytes = serialize_workflow(workflow)
     
     print(f"✅ Workflow generated successfully!")
-    print(f"   Saved to: {output_file}")
+    # Skip the write when nothing changed so file watchers don't re-import
+    if old_bytes != new_bytes:
+        # One buffer, one write: the serializer already returns final bytes
+        output_file.write_bytes(new_bytes)
+        print(f"   Saved to: {output_file}")
+    else:
+        print(f"   Unchanged: {output_file} (write skipped)")
     print(f"   Total nodes: {len(workflow['nodes'])}")
     print(f"   Model: {config.openrouter_model}")
     print(f"   Prompt version: {config.prompt_version}")